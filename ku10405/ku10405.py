@@ -18,53 +18,153 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVE
 POSSIBILITY OF SUCH DAMAGE.
 """
 
+import abc
+import asyncio
+import concurrent.futures
+import ctypes
+import ctypes.util
+import functools
+import math
+import struct
+
 from pyftdi.spi import SpiController
 
+# The apply pin both applies changes and indicates trim bits being set. When CS is high, a rising
+# edge of the apply pin indicates that settings should be applied. Trim bits are programmed when the
+# apply pin is high while CS is low during the rising edge of the first clock cycle.
+_APPLY_PIN = 7
+
+# FT232H low byte pins driven by the raw MPSSE commands. SCK (bit 0), MOSI (bit 1) and CS (bit 3)
+# belong to the SPI bus, plus the apply pin as a GPIO output. SCK idles low (mode 0).
+_CS = 1 << 3
+_DIRECTION = 0b1011 | (1 << _APPLY_PIN)
+
+# MPSSE opcodes (see FTDI AN_108)
+_SET_BITS_LOW = 0x80
+_RW_BYTES = 0x31  # clock bytes out on the falling edge and in on the rising edge, MSB first
+_WRITE_BYTES = 0x11  # clock bytes out on the falling edge, MSB first, nothing read back
+_LOOPBACK_OFF = 0x85
+_SET_CLOCK_DIVISOR = 0x86
+_SEND_IMMEDIATE = 0x87
+_DISABLE_CLOCK_DIV_5 = 0x8A
+_DISABLE_3_PHASE_CLOCK = 0x8D
+_DISABLE_ADAPTIVE_CLOCK = 0x97
+
+
+@functools.lru_cache(maxsize=1024)
+def _pack_words(base, mag, phase, enable):
+    # Returns the coarse, fine, and trim words of a tap, given the address and channel bits of its
+    # words and already validated arguments. Magnitude bits [13:9], [8:4], [3:0] and phase bits
+    # [15:11], [10:5], [4:0] go to the coarse, fine, and trim words respectively. Each phase slice
+    # lands at bit 5 of its word, and bit 11 selects the fine register. Calibration routines tend to
+    # revisit the same settings, so results are cached.
+    return (base | (enable << 10) | ((phase >> 6) & 0x3E0) | (mag >> 9),
+            base | 0x800 | (phase & 0x7E0) | ((mag >> 4) & 0x1F),
+            base | ((phase << 5) & 0x3E0) | (mag & 0xF))
+
 
 class KU10405:
     """This class controls the KU10405 chip via an FT232H SPI controller. Users should only concern
-    themselves with the constructor and set_tap method.
+    themselves with the constructor and the set_tap and set_taps methods.
 
     Example usage:
         from ku10405 import KU10405
         dut = KU10405()
         dut.set_tap(0, 100, 200)
+        dut.set_taps([100, 300, 0, 0], [200, 400, 0, 0], [True, True, False, False])
     """
 
-    # The apply pin both applies changes and indicates trim bits being set. When CS is high, a
-    # rising edge of the apply pin indicates that settings should be applied. Trim bits are
-    # programmed when the apply pin is high while CS is low during the rising edge of the first
-    # clock cycle.
-    APPLY_PIN = 7
+    APPLY_PIN = _APPLY_PIN  # see the pin notes at the top of this module
+
+    # Big-endian words as clocked over SPI. The read layouts are set_tap's and set_taps' readbacks:
+    # the meaningless first word followed by the coarse, fine, and trim readbacks of each tap.
+    _WORD = struct.Struct('>H')
+    _TAP_READ = struct.Struct('>2xHHH')
+    _TAPS_READ = struct.Struct('>2x12H')
+
+    # Word written after the last real one to clock out its readback. Writing to address 3 is
+    # assumed to do nothing, which is fine as long as we don't use that address!
+    _DUMMY = 0xFFFF
 
-    def __init__(self, readback=True, ftdi_url='ftdi://ftdi:232h/1'):
+    # Rising then falling edge on the apply pin with CS held high
+    _APPLY_PULSE = bytes((_SET_BITS_LOW, _CS | (1 << _APPLY_PIN), _DIRECTION,
+                          _SET_BITS_LOW, _CS, _DIRECTION))
+
+    def __init__(self, readback=True, ftdi_url=None, latency_ms=2, freq=1e6, backend='pyftdi'):
         """An FT232H chip must be connected to your computer for this constructor to succeed. It
         sets up the SPI/GPIO interface and configures readback.
 
         When readback is enabled, set_tap will throw an error if the readback of any write does not
         match what was programmed. Readback does have an impact on performance because it requires
-        an extra SPI transaction for every call to set_tap, but for safety it should not be disabled
-        unless speed is your top priority. Note that for readback to work, the appropriate switch on
-        the board must be set.
+        an extra SPI word and a USB read for every call to set_tap, but for safety it should not be
+        disabled unless speed is your top priority. Note that for readback to work, the appropriate
+        switch on the board must be set.
+
+        The FTDI latency timer bounds how long the FT232H holds back a partially filled USB packet,
+        which is what every readback waits on. pyftdi defaults to 16 ms; the 2 ms default here
+        makes set_tap much faster at the cost of up to 500 short USB transfers (and host interrupts)
+        per second while the FT232H has data pending.
+
+        The FT232H is driven through pyftdi by default. Set backend to 'libftdi' to use the libftdi1
+        C library instead, which has less per-call Python overhead than pyftdi's pure-Python USB
+        stack. libftdi1 must then be installed on your system.
 
         Args:
             readback (bool, optional): Set to False to disable readback error checking
+            ftdi_url (str, optional): Device to open. This is a pyftdi URL (default
+                'ftdi://ftdi:232h/1') or a libftdi device string (default 'i:0x0403:0x6014')
+                depending on the backend.
+            latency_ms (int, optional): FTDI latency timer in milliseconds (range: [1, 255])
+            freq (float, optional): SPI clock frequency in Hz (range: (0, 30e6]). The FT232H can go
+                up to 30 MHz, but only the 1 MHz default has been validated with the KU10405.
+            backend (str, optional): 'pyftdi' or 'libftdi'
+
+        Raises:
+            ValueError: raised if the latency, frequency, or backend is invalid
         """
+        if not 1 <= latency_ms <= 255:
+            raise ValueError('Latency must be in range [1, 255]')
+        if not 0 < freq <= 30e6:
+            raise ValueError('Frequency must be in range (0, 30e6]')
         self._readback = readback
 
-        # Setup SPI interface
-        self._spi_controller = SpiController()
-        self._spi_controller.configure(ftdi_url)
-        self._spi = self._spi_controller.get_port(cs=0, mode=0, freq=1e6)
-
-        # Setup GPIO interface
-        self._gpio = self._spi_controller.get_gpio()
-        self._gpio.set_direction(1 << self.APPLY_PIN, 1 << self.APPLY_PIN)  # make APLS an output
-        self._set_apply(False)
+        # Setup SPI/GPIO interface. set_tap drives the MPSSE engine directly, so all the backend has
+        # to provide is raw command writes and reads, with the apply pin set up as a low output.
+        if backend not in _BACKENDS:
+            raise ValueError('Unrecognized backend {}'.format(backend))
+        backend_cls = _BACKENDS[backend]
+        self._backend = backend_cls(ftdi_url or backend_cls.DEFAULT_URL, freq, latency_ms)
 
         # We're always going to use address 0. This is here just in case that changes.
         self._addr = 0
 
+        # Address and channel bits of every word, indexed by channel
+        self._base = tuple((self._addr << 14) | (channel << 12) for channel in range(4))
+
+        # Commands before and after the data bytes of a word's CS frame, for regular and trim words
+        self._word_parts = self._frame_parts(False)
+        self._trim_parts = self._frame_parts(True)
+
+        # Dummy word frame that flushes out the readback, and the command that sends it immediately
+        self._readback_tail = self._frame(self._word_parts, self._DUMMY) + bytes((_SEND_IMMEDIATE,))
+
+        # set_tap always sends the same commands and only the data bytes of its three words change,
+        # so build the buffer once and pack each call's words straight into it. It is indexed by
+        # apply since the apply pulse can only be part of the buffer without readback.
+        cmd = bytearray()
+        self._tap_offsets = []
+        for prefix, suffix in (self._word_parts, self._word_parts, self._trim_parts):
+            self._tap_offsets.append(len(cmd) + len(prefix))
+            cmd += prefix + bytes(2) + suffix
+        if readback:
+            cmd += self._readback_tail
+            self._tap_cmds = (cmd, cmd)
+        else:
+            self._tap_cmds = (cmd, cmd + self._APPLY_PULSE)
+
+        # Worker thread of the async methods, only started once one of them is used
+        self._executor = None
+
     def set_tap(self, channel, mag, phase, enable=True, apply=True):
         """Sets the tap at the given channel to the given magnitude and phase. Magnitude and phase
         values control bits, not logical values. Disable the channel by setting enable to False.
@@ -79,75 +179,298 @@ class KU10405:
             apply (bool, optional): Set to False if you don't want to apply these changes yet
 
         Raises:
-            TypeError: raised if any arguments have the wrong type
+            TypeError: raised if any arguments have the wrong type (not checked under python -O)
             ValueError: raised if any arguments are out-of-range
         """
-        if not all(isinstance(val, int) for val in (channel, mag, phase)):
-            raise TypeError('Channel, magnitude, and phase must be integers')
-        if not all(isinstance(val, bool) for val in (enable, apply)):
+        if __debug__ and type(apply) is not bool:
             raise TypeError('Enable and apply must be bools')
-        if not 0 <= channel <= 3:
+
+        writes = self._pack(channel, mag, phase, enable)
+        cmd = self._tap_cmds[1 if apply else 0]
+        pack_into = self._WORD.pack_into
+        for offset, wdata in zip(self._tap_offsets, writes):
+            pack_into(cmd, offset, wdata)
+
+        self._send(cmd, (writes,), self._TAP_READ, apply)
+
+    def set_taps(self, mags, phases, enables=(True, True, True, True), apply=True):
+        """Sets the taps of all four channels at once. This is equivalent to calling set_tap for
+        channels 0-3 in order with apply only set on the last call, but everything is sent to the
+        chip in a single USB transaction, so it is considerably faster.
+
+        Args:
+            mags (sequence of int): 14-bit attenuation of each channel (range: [0, 2^14))
+            phases (sequence of int): 16-bit phase of each channel (range: [0, 2^16))
+            enables (sequence of bool, optional): Set an entry to False to disable that channel
+            apply (bool, optional): Set to False if you don't want to apply these changes yet
+
+        Raises:
+            TypeError: raised if any arguments have the wrong type (not checked under python -O)
+            ValueError: raised if any arguments are out-of-range or don't cover all four channels
+        """
+        if not len(mags) == len(phases) == len(enables) == 4:
+            raise ValueError('Magnitudes, phases, and enables must have one entry per channel')
+        if __debug__ and type(apply) is not bool:
+            raise TypeError('Enable and apply must be bools')
+
+        writes = tuple(self._pack(channel, mags[channel], phases[channel], enables[channel])
+                       for channel in range(4))
+        frame, word_parts, trim_parts = self._frame, self._word_parts, self._trim_parts
+        cmd = b''.join(frame(word_parts, coarse) + frame(word_parts, fine) + frame(trim_parts, trim)
+                       for coarse, fine, trim in writes)
+        if self._readback:
+            cmd += self._readback_tail
+        elif apply:
+            cmd += self._APPLY_PULSE
+        self._send(cmd, writes, self._TAPS_READ, apply)
+
+    async def set_tap_async(self, channel, mag, phase, enable=True, apply=True):
+        """Same as set_tap, but runs on a worker thread so the event loop can get on with other
+        work (like computing the next setting of a sweep) while the USB transfer completes. Calls
+        run one at a time in the order they were made. Don't mix them with set_tap or set_taps calls
+        that run while an async call is still pending.
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._async_executor(), self.set_tap, channel, mag, phase,
+                                   enable, apply)
+
+    async def set_taps_async(self, mags, phases, enables=(True, True, True, True), apply=True):
+        """Same as set_taps, but runs on a worker thread just like set_tap_async."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._async_executor(), self.set_taps, mags, phases, enables,
+                                   apply)
+
+    def close(self):
+        """Releases the FT232H, after waiting for any pending set_tap_async or set_taps_async calls
+        to finish. The object can't be used afterwards. Using the object as a context manager calls
+        this automatically.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _async_executor(self):
+        # A single worker thread runs the async methods so they stay in order and never overlap
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def _pack(self, channel, mag, phase, enable):
+        # Type checks are skipped under python -O, leaving it to the arithmetic below to fail. The
+        # range checks always run since out-of-range values would spill into neighbouring fields.
+        if __debug__:
+            if type(channel) is not int or type(mag) is not int or type(phase) is not int:
+                raise TypeError('Channel, magnitude, and phase must be integers')
+            if type(enable) is not bool:
+                raise TypeError('Enable and apply must be bools')
+        # Shifting out the valid bits leaves 0 only for in-range values (negatives shift to -1)
+        if channel >> 2:
             raise ValueError('Address and channel must be in range [0, 3]')
-        if not 0 <= mag <= 16383:
+        if mag >> 14:
             raise ValueError('Magnitude must be in range [0, 16383]')
-        if not 0 <= phase <= 65535:
+        if phase >> 16:
             raise ValueError('Phase must be in range [0, 65535]')
+        if enable >> 1:
+            raise ValueError('Enable must be True or False')
 
-        coarse_write, _ = \
-            self._write(channel, 'coarse', mag >> 9, phase >> 11, enable)
-        fine_write, coarse_read = \
-            self._write(channel, 'fine', (mag >> 4) & 0x1F, (phase >> 5) & 0x3F)
-        trim_write, fine_read = \
-            self._write(channel, 'trim', mag & 0xF, phase & 0x1F)
+        return _pack_words(self._base[channel], mag, phase, enable)
 
-        if self._readback:
-            # Do a dummy write so we can get the trim readback. Note that this assumes we are not
-            # using address 3!
-            trim_read = self._spi.exchange((0xFFFF).to_bytes(2, byteorder='big'), duplex=True)
-            trim_read = (trim_read[0] << 8) | trim_read[1]
+    def _send(self, cmd, writes, read_layout, apply):
+        # Sends the frames of one or more taps' (coarse, fine, trim) writes in a single USB
+        # transaction. Without readback the words are only clocked out, which saves the USB IN
+        # transfer entirely, and cmd must already end with the apply pulse if apply is set. With
+        # readback, cmd must end with the readback tail: each read returns the previous word, so a
+        # trailing dummy write gets us the last trim readback.
+        if not self._readback:
+            self._backend.write(cmd)
+            return
 
-            if coarse_write != coarse_read or fine_write != fine_read or trim_write != trim_read:
-                raise IOError(
-                    'Readbacks do not match! Wrote coarse {}, fine {}, trim {}, but '
-                    'read coarse {}, fine {}, trim {}'.format(coarse_write, fine_write, trim_write,
-                                                              coarse_read, fine_read, trim_read))
+        reads = read_layout.unpack(self._exchange(cmd, read_layout.size))
+        for index, write in enumerate(writes):
+            read = reads[3 * index:3 * index + 3]
+            if write != read:
+                raise self._readback_error(write, read)
 
+        # Only apply once the readback has been verified. This is a write with nothing to wait for,
+        # so it doesn't cost another round-trip.
         if apply:
-            self._set_apply(True)
-            self._set_apply(False)
-
-    def _write(self, channel, reg_type, mag, phase, enable=None):
-        if reg_type not in ('coarse', 'fine', 'trim'):
-            raise ValueError('Unrecognized register type {}'.format(reg_type))
-        if reg_type == 'coarse' and enable is None:
-            raise ValueError('Enable must be specified for coarse write')
-        if reg_type in ('coarse', 'fine') and not 0 <= mag <= 31:
-            raise ValueError('Coarse/fine magnitudes must be in range [0, 31]')
-        if reg_type == 'trim' and not 0 <= mag <= 15:
-            raise ValueError('Trim magnitude must be in range [0, 15]')
-        if reg_type in ('coarse', 'trim') and not 0 <= phase <= 31:
-            raise ValueError('Coarse/trim phases must be in range [0, 31]')
-        if reg_type == 'fine' and not 0 <= phase <= 63:
-            raise ValueError('Fine phase must be in range [0, 63]')
-
-        wdata = (self._addr << 14) | (channel << 12)
-        if reg_type == 'coarse':
-            wdata |= (enable << 10) | (phase << 5) | mag
-        elif reg_type == 'fine':
-            wdata |= (1 << 11) | (phase << 5) | mag
-        else:  # trim
-            wdata |= (phase << 5) | mag
-            self._set_apply(True)
-
-        rdata = self._spi.exchange(wdata.to_bytes(2, byteorder='big'), duplex=True)
-        rdata = (rdata[0] << 8) | rdata[1]
-
-        if reg_type == 'trim':
-            self._set_apply(False)
-
-        return wdata, rdata
-
-    def _set_apply(self, value):
-        if not isinstance(value, bool):
-            raise TypeError('GPIO value must be a bool.')
-        self._gpio.write(value << self.APPLY_PIN)
+            self._backend.write(self._APPLY_PULSE)
+
+    def _frame(self, parts, wdata):
+        # MPSSE commands that clock one word out in its own CS frame, given the (prefix, suffix)
+        # parts of a regular or trim word. The chip latches a word when CS rises, so words can share
+        # a USB transaction but not a CS frame.
+        prefix, suffix = parts
+        return prefix + self._WORD.pack(wdata) + suffix
+
+    def _frame_parts(self, trim):
+        # The commands of a frame before and after its two data bytes. Trim words raise the apply
+        # pin while CS is high, keep it high through the CS-low frame, and drop it once CS is high
+        # again.
+        apply = trim << _APPLY_PIN
+        clock = _RW_BYTES if self._readback else _WRITE_BYTES
+        cs_low = bytes((_SET_BITS_LOW, apply, _DIRECTION))
+        cs_high = bytes((_SET_BITS_LOW, _CS | apply, _DIRECTION))
+        prefix = cs_low + bytes((clock, 1, 0))
+        suffix = cs_high
+        if trim:
+            prefix = cs_high + prefix
+            suffix += bytes((_SET_BITS_LOW, _CS, _DIRECTION))
+        return prefix, suffix
+
+    def _exchange(self, cmd, readlen):
+        # cmd must end with SEND_IMMEDIATE so the readback isn't held back by the latency timer
+        self._backend.write(cmd)
+        rdata = self._backend.read(readlen)
+        if len(rdata) != readlen:
+            raise IOError('Expected {} bytes of readback, got {}'.format(readlen, len(rdata)))
+        return rdata
+
+    @staticmethod
+    def _readback_error(write, read):
+        return IOError('Readbacks do not match! Wrote coarse {}, fine {}, trim {}, but '
+                       'read coarse {}, fine {}, trim {}'.format(*write, *read))
+
+
+class _Backend(abc.ABC):
+    """Raw access to the FT232H's MPSSE engine, with SCK, MOSI, MISO and CS on ADBUS0-3 and the
+    apply pin as a GPIO output. Subclasses open and configure the device in their constructor,
+    which takes the device URL, the SPI clock frequency in Hz, and the latency timer in
+    milliseconds, and leave CS high and the apply pin low.
+    """
+
+    DEFAULT_URL = None
+
+    @abc.abstractmethod
+    def write(self, data):
+        """Writes MPSSE commands to the device."""
+
+    @abc.abstractmethod
+    def read(self, size):
+        """Reads up to size bytes of data clocked in by previous commands."""
+
+    @abc.abstractmethod
+    def close(self):
+        """Releases the USB device. Calling this more than once does nothing."""
+
+
+class _PyFtdiBackend(_Backend):
+    DEFAULT_URL = 'ftdi://ftdi:232h/1'
+
+    def __init__(self, url, freq, latency_ms):
+        # The frequency has to be set here since we never go through an SPI port's exchange, which
+        # is where pyftdi would normally set it.
+        self._spi_controller = SpiController(cs_count=1)
+        self._spi_controller.configure(url, frequency=freq)
+        self._ftdi = self._spi_controller.ftdi
+        self._ftdi.set_latency_timer(latency_ms)
+
+        # CS high and the apply pin as a low output
+        self.write(bytes((_SET_BITS_LOW, _CS, _DIRECTION)))
+
+    def write(self, data):
+        self._ftdi.write_data(data)
+
+    def read(self, size):
+        return self._ftdi.read_data_bytes(size, 4)
+
+    def close(self):
+        self._spi_controller.terminate()
+
+
+class _LibFtdiBackend(_Backend):
+    DEFAULT_URL = 'i:0x0403:0x6014'
+
+    _BITMODE_RESET = 0x00
+    _BITMODE_MPSSE = 0x02
+    _READ_ATTEMPTS = 4
+
+    def __init__(self, url, freq, latency_ms):
+        self._ctx = None  # so __del__ works however far this gets
+        name = ctypes.util.find_library('ftdi1')
+        if name is None:
+            raise OSError('Could not find the libftdi1 library')
+        self._lib = lib = ctypes.CDLL(name)
+
+        lib.ftdi_new.restype = ctypes.c_void_p
+        lib.ftdi_new.argtypes = ()
+        lib.ftdi_free.argtypes = (ctypes.c_void_p,)
+        lib.ftdi_get_error_string.restype = ctypes.c_char_p
+        lib.ftdi_get_error_string.argtypes = (ctypes.c_void_p,)
+        lib.ftdi_usb_open_string.argtypes = (ctypes.c_void_p, ctypes.c_char_p)
+        lib.ftdi_usb_reset.argtypes = (ctypes.c_void_p,)
+        lib.ftdi_usb_close.argtypes = (ctypes.c_void_p,)
+        lib.ftdi_set_latency_timer.argtypes = (ctypes.c_void_p, ctypes.c_ubyte)
+        lib.ftdi_set_bitmode.argtypes = (ctypes.c_void_p, ctypes.c_ubyte, ctypes.c_ubyte)
+        lib.ftdi_write_data.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int)
+        lib.ftdi_read_data.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int)
+        # ftdi_usb_purge_buffers was renamed in libftdi 1.5
+        purge = getattr(lib, 'ftdi_tcioflush', None) or lib.ftdi_usb_purge_buffers
+        purge.argtypes = (ctypes.c_void_p,)
+
+        self._ctx = lib.ftdi_new()
+        if not self._ctx:
+            raise IOError('Could not allocate a libftdi context')
+        self._check(lib.ftdi_usb_open_string(self._ctx, url.encode()))
+        self._check(lib.ftdi_usb_reset(self._ctx))
+        self._check(lib.ftdi_set_latency_timer(self._ctx, latency_ms))
+        self._check(lib.ftdi_set_bitmode(self._ctx, 0, self._BITMODE_RESET))
+        self._check(lib.ftdi_set_bitmode(self._ctx, 0, self._BITMODE_MPSSE))
+        self._check(purge(self._ctx))
+
+        # Use the 60 MHz base clock without adaptive or three-phase clocking, turn off loopback and
+        # divide the clock down to at most freq (SCK = 60 MHz / (2 * (1 + divisor)))
+        divisor = math.ceil(30e6 / freq) - 1
+        if divisor > 0xFFFF:
+            raise ValueError('Frequency must be at least {:.0f} Hz'.format(30e6 / 0x10000))
+        self.write(bytes((_DISABLE_CLOCK_DIV_5, _DISABLE_ADAPTIVE_CLOCK, _DISABLE_3_PHASE_CLOCK,
+                          _LOOPBACK_OFF, _SET_CLOCK_DIVISOR, divisor & 0xFF, divisor >> 8)))
+
+        # CS high and the apply pin as a low output
+        self.write(bytes((_SET_BITS_LOW, _CS, _DIRECTION)))
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._ctx:
+            self._lib.ftdi_usb_close(self._ctx)
+            self._lib.ftdi_free(self._ctx)
+            self._ctx = None
+
+    def write(self, data):
+        size = len(data)
+        if isinstance(data, bytearray):
+            # Pass set_tap's reused buffer without copying it
+            data = (ctypes.c_char * size).from_buffer(data)
+        written = self._check(self._lib.ftdi_write_data(self._ctx, data, size))
+        if written != size:
+            raise IOError('Wrote {} of {} bytes'.format(written, size))
+
+    def read(self, size):
+        # Like pyftdi, only give up after several reads in a row came back empty
+        buf = ctypes.create_string_buffer(size)
+        count = 0
+        attempts = self._READ_ATTEMPTS
+        while count < size and attempts:
+            ret = self._check(
+                self._lib.ftdi_read_data(self._ctx, ctypes.byref(buf, count), size - count))
+            count += ret
+            attempts = self._READ_ATTEMPTS if ret else attempts - 1
+        return buf.raw[:count]
+
+    def _check(self, ret):
+        if ret < 0:
+            raise IOError('libftdi error {}: {}'.format(
+                ret, self._lib.ftdi_get_error_string(self._ctx).decode()))
+        return ret
+
+
+_BACKENDS = {'pyftdi': _PyFtdiBackend, 'libftdi': _LibFtdiBackend}